@@ -6,16 +6,34 @@ Docker 离线安装包自动更新脚本 (GitHub Actions 优化版)
 """
 
 import os
+import re
+import atexit
 import sys
+import gzip
 import json
-import urllib.request
-import urllib.error
+import mmap
+import ssl
+import time
+import http.client
+import urllib.parse
 import hashlib
 import shutil
 import argparse
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
 
+# 版本号解析用正则（预编译）
+_SEMVER_RE = re.compile(r'(\d+\.\d+\.\d+)')
+# 索引页: 直接按字节匹配，无需整体解码
+_DOCKER_TGZ_RE_B = re.compile(rb'docker-(\d+\.\d+\.\d+)\.tgz')
+_ROOTLESS_TGZ_RE_B = re.compile(rb'docker-rootless-extras-(\d+\.\d+\.\d+)\.tgz')
+# 本地文件名: 版本号 + 架构
+_DOCKER_FILE_RE = re.compile(r'docker-(\d+\.\d+\.\d+)-(.+)\.tgz')
+_ROOTLESS_FILE_RE = re.compile(r'docker-rootless-extras-(\d+\.\d+\.\d+)-(.+)\.tgz')
+_COMPOSE_FILE_RE = re.compile(r'docker-compose-linux-(\d+\.\d+\.\d+)-(.+)')
+
 # ANSI 颜色代码 - VS Code 风格
 class Colors:
     RESET = "\033[0m"
@@ -31,11 +49,207 @@ class Colors:
     DIMMED = "\033[0;37m"         # 淡白色 - 详细信息
     BOLD = "\033[1m"              # 加粗
 
+
+class HTTPStatusError(Exception):
+    """HTTP 响应状态码异常"""
+    def __init__(self, code, url):
+        super().__init__(f"HTTP {code}: {url}")
+        self.code = code
+        self.url = url
+
+
+class PooledResponse:
+    """连接池返回的响应，关闭时将连接归还连接池"""
+    def __init__(self, pool, key, conn, raw, url):
+        self._pool = pool
+        self._key = key
+        self._conn = conn
+        self._raw = raw
+        self.url = url
+        self.status = raw.status
+        self.headers = raw.headers
+    
+    def read(self, amt=None):
+        return self._raw.read(amt)
+    
+    def read_decoded(self):
+        """读取完整响应体，按 Content-Encoding 解压 gzip"""
+        body = self._raw.read()
+        if self.headers.get('Content-Encoding', '').lower() == 'gzip':
+            body = gzip.decompress(body)
+        return body
+    
+    def raise_for_status(self):
+        if self.status >= 400:
+            raise HTTPStatusError(self.status, self.url)
+    
+    def close(self):
+        if self._conn is None:
+            return
+        raw, conn = self._raw, self._conn
+        self._conn = None
+        # HEAD / 空响应体可直接标记读取完毕
+        if not raw.isclosed() and not raw.chunked and raw.length == 0:
+            raw.read()
+        if raw.isclosed() and not raw.will_close:
+            self._pool._put_conn(self._key, conn)
+        else:
+            # 响应体未读完时连接状态不可复用
+            raw.close()
+            conn.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
+
+
+class _HashingReader:
+    """包装响应流：读取时同步更新哈希并回调已读取字节数，配合 shutil.copyfileobj 使用"""
+    def __init__(self, fsrc, hash_obj, on_read=None):
+        self._fsrc = fsrc
+        self._hash_obj = hash_obj
+        self._on_read = on_read
+        self.bytes_read = 0
+    
+    def read(self, size=-1):
+        data = self._fsrc.read(size)
+        if data:
+            self._hash_obj.update(data)
+            self.bytes_read += len(data)
+            if self._on_read:
+                self._on_read(self.bytes_read)
+        return data
+
+
+class ConnectionPool:
+    """基于 http.client 的连接池，同一主机复用 keep-alive 连接与 TLS 会话，支持重试与重定向"""
+    REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+    
+    def __init__(self, maxsize=8, connect_timeout=10, read_timeout=120, retries=3,
+                 backoff_factor=1, status_forcelist=(500, 502, 503, 504), max_redirects=5):
+        self.maxsize = maxsize
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.status_forcelist = status_forcelist
+        self.max_redirects = max_redirects
+        self._ssl_context = ssl.create_default_context()
+        self._idle = {}
+        self._lock = threading.Lock()
+    
+    def _new_conn(self, key):
+        scheme, host, port = key
+        if scheme == "https":
+            return http.client.HTTPSConnection(host, port, timeout=self.connect_timeout, context=self._ssl_context)
+        return http.client.HTTPConnection(host, port, timeout=self.connect_timeout)
+    
+    def _put_conn(self, key, conn):
+        with self._lock:
+            conns = self._idle.setdefault(key, [])
+            if len(conns) < self.maxsize:
+                conns.append(conn)
+                return
+        conn.close()
+    
+    def _send(self, conn, method, path, headers):
+        try:
+            if conn.sock is None:
+                conn.connect()
+                conn.sock.settimeout(self.read_timeout)
+            conn.request(method, path, headers=headers)
+            return conn.getresponse()
+        except BaseException:
+            conn.close()
+            raise
+    
+    def _urlopen(self, method, url, headers):
+        parts = urllib.parse.urlsplit(url)
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        key = (parts.scheme, parts.hostname, port)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+        
+        with self._lock:
+            idle = self._idle.get(key)
+            conn = idle.pop() if idle else None
+        if conn is not None:
+            try:
+                return PooledResponse(self, key, conn, self._send(conn, method, path, headers), url)
+            except (OSError, http.client.HTTPException):
+                # 空闲连接可能已被服务端关闭，换新连接再试
+                pass
+        conn = self._new_conn(key)
+        return PooledResponse(self, key, conn, self._send(conn, method, path, headers), url)
+    
+    def request(self, method, url, headers=None):
+        """发送请求，返回 PooledResponse（需关闭以归还连接）"""
+        headers = dict(headers or {})
+        redirects = 0
+        attempt = 0
+        while True:
+            if attempt:
+                time.sleep(self.backoff_factor * (2 ** (attempt - 1)))
+            try:
+                resp = self._urlopen(method, url, headers)
+            except ssl.SSLCertVerificationError:
+                # 证书错误重试无意义，直接失败
+                raise
+            except (OSError, http.client.HTTPException):
+                if attempt >= self.retries:
+                    raise
+                attempt += 1
+                continue
+            
+            if resp.status in self.REDIRECT_STATUSES and resp.headers.get("Location") and redirects < self.max_redirects:
+                location = urllib.parse.urljoin(url, resp.headers["Location"])
+                resp.read()
+                resp.close()
+                if resp.status == 303:
+                    method = "GET"
+                url = location
+                redirects += 1
+                continue
+            
+            if resp.status in self.status_forcelist and attempt < self.retries:
+                resp.read()
+                resp.close()
+                attempt += 1
+                continue
+            
+            return resp
+
+
+def _file_hash(path, algorithm='sha256'):
+    """计算文件哈希：Python 3.11+ 使用 hashlib.file_digest，否则通过 mmap 一次性交给 C 实现"""
+    with open(path, 'rb') as f:
+        if hasattr(hashlib, 'file_digest'):
+            return hashlib.file_digest(f, algorithm).hexdigest()
+        try:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                return hashlib.new(algorithm, mm).hexdigest()
+        except (ValueError, OSError):
+            # 空文件或不支持 mmap 的文件，退回分块读取
+            hash_obj = hashlib.new(algorithm)
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                hash_obj.update(chunk)
+            return hash_obj.hexdigest()
+
+
+def _sha256_file(path):
+    """计算文件 SHA256（顶层函数，便于在进程池中执行）"""
+    return _file_hash(path, 'sha256')
+
+
 class DockerUpdater:
-    def __init__(self, output_dir="./packages", architectures=None, ci_mode=False):
+    def __init__(self, output_dir="./packages", architectures=None, ci_mode=False, max_workers=8):
         self.output_dir = Path(output_dir)
         self.output_dir.mkdir(exist_ok=True)
         self.ci_mode = ci_mode
+        self.max_workers = max_workers
         
         self.architectures = architectures or ["x86_64", "aarch64"]
         
@@ -56,7 +270,31 @@ class DockerUpdater:
         self.compose_url_template = "https://github.com/docker/compose/releases/download/v{version}/docker-compose-linux-{arch}"
         self.rootless_url_template = "https://download.docker.com/linux/static/stable/{arch}/docker-rootless-extras-{version}.tgz"
         
+        # GitHub API 响应缓存: {url: {"etag": ..., "body": ...}}
+        self.api_cache_file = self.output_dir / ".gh_api_cache.json"
+        self._api_cache = self._load_json_cache(self.api_cache_file)
+        
+        # 下载缓存: {url: {"etag", "last_modified", "sha256", "size", "local_name"}}
+        # 仅在本地文件仍存在时生效，CI 每次全新检出不含安装包，因此只对本地重复运行有用
+        self.download_cache_file = self.output_dir / ".dl_cache.json"
+        self._download_cache = self._load_json_cache(self.download_cache_file)
+        
+        # 同一次运行内缓存静态索引页原始字节及解析结果，按架构区分
+        self._index_cache = {}
+        self._static_versions_cache = {}
+        self._rootless_versions_cache = {}
+        self._resolved_versions_cache = {}
+        
+        # 已获取的 Compose 发布资源列表: {版本号: assets}
+        self._compose_assets = {}
+        
+        # 下载过程中计算得到的 SHA256，供生成校验和文件时复用: {文件名: sha256}
+        self._hashes = {}
+        
         self.log_file = self.output_dir / f"update_log_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt"
+        # 日志文件在整个运行期间保持打开（行缓冲），避免每条日志都 open/close
+        self._log_fh = open(self.log_file, "a", encoding="utf-8", buffering=1)
+        atexit.register(self._log_fh.close)
         
         self.download_stats = {
             'success': 0,
@@ -64,6 +302,15 @@ class DockerUpdater:
             'skipped': 0,
             'total_size': 0
         }
+        
+        # 待写入 $GITHUB_OUTPUT 的输出变量
+        self._pending_outputs = {}
+        
+        # 并发下载时保护日志输出与统计数据
+        self._lock = threading.RLock()
+        
+        # 复用 HTTP 连接，避免每个请求重新建立 TCP + TLS
+        self.http = ConnectionPool(maxsize=max_workers, connect_timeout=10, read_timeout=120, retries=3, backoff_factor=1)
     
     def log(self, message, level="INFO", icon=""):
         """输出日志消息"""
@@ -98,65 +345,125 @@ class DockerUpdater:
         else:
             output = f"{Colors.TIMESTAMP}{timestamp}{Colors.RESET} {color}{level_padded}{Colors.RESET} {icon_str}{message}"
         
-        print(output)
-        
         # 写入日志文件（移除颜色代码）
         clean_message = message
         for color_code in [Colors.KEY, Colors.VALUE, Colors.RESET, Colors.DIMMED]:
             clean_message = clean_message.replace(color_code, "")
-        with open(self.log_file, "a", encoding="utf-8") as f:
-            f.write(f"[{timestamp}] [{level}] {clean_message}\n")
+        
+        with self._lock:
+            print(output)
+            self._log_fh.write(f"[{timestamp}] [{level}] {clean_message}\n")
+    
+    def _add_stat(self, key, value=1):
+        """线程安全地累加下载统计"""
+        with self._lock:
+            self.download_stats[key] += value
     
     def set_output(self, name, value):
-        """设置 GitHub Actions 输出变量"""
-        if self.ci_mode and os.getenv('GITHUB_OUTPUT'):
-            with open(os.getenv('GITHUB_OUTPUT'), 'a') as f:
-                f.write(f"{name}={value}\n")
+        """设置 GitHub Actions 输出变量（暂存，由 flush_outputs 统一写入）"""
+        if self.ci_mode:
+            self._pending_outputs[name] = value
     
-    def check_url_exists(self, url):
+    def flush_outputs(self):
+        """一次性写入所有暂存的 GitHub Actions 输出变量"""
+        output_file = os.getenv('GITHUB_OUTPUT')
+        if not (self._pending_outputs and output_file):
+            return
+        with open(output_file, 'a') as f:
+            f.writelines(f"{name}={value}\n" for name, value in self._pending_outputs.items())
+        self._pending_outputs.clear()
+    
+    def _load_json_cache(self, path):
+        """读取 JSON 缓存文件，不存在或损坏时返回空字典"""
         try:
-            req = urllib.request.Request(url, method="HEAD")
-            req.add_header('User-Agent', 'Mozilla/5.0')
-            with urllib.request.urlopen(req, timeout=20) as _:
-                return True
-        except Exception:
-            return False
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
     
-    def list_static_versions(self, arch):
+    def _save_json_cache(self, path, data):
+        """写入 JSON 缓存文件（调用方需持有 self._lock），失败时返回异常，由调用方释放锁后记录"""
         try:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+        except OSError as e:
+            return e
+        return None
+    
+    def _github_get_json(self, url):
+        """请求 GitHub API，使用 ETag 条件请求，未变更 (304) 时直接返回缓存内容"""
+        with self._lock:
+            cached = self._api_cache.get(url)
+        
+        headers = {'User-Agent': 'Mozilla/5.0', 'Accept': 'application/vnd.github.v3+json', 'Accept-Encoding': 'gzip'}
+        if cached and cached.get('etag'):
+            headers['If-None-Match'] = cached['etag']
+        
+        with self.http.request('GET', url, headers=headers) as response:
+            body = response.read_decoded()
+            if response.status == 304 and cached:
+                self.log(f"GitHub API 未变更，使用缓存: {Colors.DIMMED}{url}{Colors.RESET}", "DEBUG", "")
+                return cached['body']
+            response.raise_for_status()
+            data = json.loads(body.decode())
+            etag = response.headers.get('ETag')
+        
+        if etag:
+            with self._lock:
+                self._api_cache[url] = {"etag": etag, "body": data}
+                error = self._save_json_cache(self.api_cache_file, self._api_cache)
+            if error:
+                self.log(f"写入缓存失败 {self.api_cache_file}: {error}", "WARNING", "⚠️")
+        return data
+    
+    def _fetch_index(self, arch):
+        """获取静态下载索引页（原始字节），同一架构只请求一次"""
+        data = self._index_cache.get(arch)
+        if data is None:
             index_url = f"https://download.docker.com/linux/static/stable/{arch}/"
-            req = urllib.request.Request(index_url)
-            req.add_header('User-Agent', 'Mozilla/5.0')
-            with urllib.request.urlopen(req, timeout=30) as resp:
-                html = resp.read().decode()
-            import re
-            versions = re.findall(r'docker-(\d+\.\d+\.\d+)\.tgz', html)
+            with self.http.request('GET', index_url, headers={'User-Agent': 'Mozilla/5.0', 'Accept-Encoding': 'gzip'}) as resp:
+                resp.raise_for_status()
+                data = resp.read_decoded()
+            self._index_cache[arch] = data
+        return data
+    
+    def list_static_versions(self, arch):
+        if arch in self._static_versions_cache:
+            return self._static_versions_cache[arch]
+        try:
+            data = self._fetch_index(arch)
+            versions = [m.decode() for m in _DOCKER_TGZ_RE_B.findall(data)]
             versions = sorted(set(versions), key=lambda v: tuple(map(int, v.split('.'))), reverse=True)
+            self._static_versions_cache[arch] = versions
             return versions
         except Exception as e:
             self.log(f"列举静态版本失败: {e}", "ERROR", "✗")
             return []
     
     def list_rootless_versions(self, arch):
+        if arch in self._rootless_versions_cache:
+            return self._rootless_versions_cache[arch]
         try:
-            index_url = f"https://download.docker.com/linux/static/stable/{arch}/"
-            req = urllib.request.Request(index_url)
-            req.add_header('User-Agent', 'Mozilla/5.0')
-            with urllib.request.urlopen(req, timeout=30) as resp:
-                html = resp.read().decode()
-            import re
-            versions = re.findall(r'docker-rootless-extras-(\d+\.\d+\.\d+)\.tgz', html)
+            data = self._fetch_index(arch)
+            versions = [m.decode() for m in _ROOTLESS_TGZ_RE_B.findall(data)]
             versions = sorted(set(versions), key=lambda v: tuple(map(int, v.split('.'))), reverse=True)
+            self._rootless_versions_cache[arch] = versions
             return versions
         except Exception as e:
             self.log(f"列举 rootless 版本失败: {e}", "ERROR", "✗")
             return []
     
     def resolve_static_version_for_arch(self, arch, desired_version):
-        docker_url = self.docker_url_template.format(arch=arch, version=desired_version)
-        if self.check_url_exists(docker_url):
-            return desired_version
+        key = (arch, desired_version)
+        if key not in self._resolved_versions_cache:
+            self._resolved_versions_cache[key] = self._resolve_static_version(arch, desired_version)
+        return self._resolved_versions_cache[key]
+    
+    def _resolve_static_version(self, arch, desired_version):
+        # 索引页已列出全部可用版本，直接判断是否包含目标版本
         avail = self.list_static_versions(arch)
+        if desired_version in avail:
+            return desired_version
         if avail:
             fallback = avail[0]
             self.log(f"目标版本 {Colors.KEY}{desired_version}{Colors.RESET} 不存在，{arch} 回退到可用版本 {Colors.VALUE}{fallback}{Colors.RESET}", "WARNING", "⊘")
@@ -168,20 +475,13 @@ class DockerUpdater:
         """获取最新的 Docker 版本号"""
         try:
             self.log("正在获取最新 Docker 版本...", "INFO", "🔍")
-            url = "https://api.github.com/repos/moby/moby/releases/latest"
-            req = urllib.request.Request(url)
-            req.add_header('User-Agent', 'Mozilla/5.0')
-            req.add_header('Accept', 'application/vnd.github.v3+json')
-            
-            with urllib.request.urlopen(req, timeout=30) as response:
-                data = json.loads(response.read().decode())
-                tag = data['tag_name']
-                import re
-                m = re.search(r'(\d+\.\d+\.\d+)', tag)
-                version = m.group(1) if m else tag.lstrip('v').replace('docker-', '').replace('engine-', '')
-                self.log(f"找到最新 Docker 版本: {Colors.VALUE}{version}{Colors.RESET}", "NOTICE", "✓")
-                self.set_output('docker_version', version)
-                return version
+            data = self._github_get_json("https://api.github.com/repos/moby/moby/releases/latest")
+            tag = data['tag_name']
+            m = _SEMVER_RE.search(tag)
+            version = m.group(1) if m else tag.lstrip('v').replace('docker-', '').replace('engine-', '')
+            self.log(f"找到最新 Docker 版本: {Colors.VALUE}{version}{Colors.RESET}", "NOTICE", "✓")
+            self.set_output('docker_version', version)
+            return version
         except Exception as e:
             self.log(f"获取 Docker 版本失败: {e}", "ERROR", "✗")
             return "27.4.1"
@@ -190,17 +490,12 @@ class DockerUpdater:
         """获取最新的 Docker Compose 版本号"""
         try:
             self.log("正在获取最新 Docker Compose 版本...", "INFO", "🔍")
-            url = "https://api.github.com/repos/docker/compose/releases/latest"
-            req = urllib.request.Request(url)
-            req.add_header('User-Agent', 'Mozilla/5.0')
-            req.add_header('Accept', 'application/vnd.github.v3+json')
-            
-            with urllib.request.urlopen(req, timeout=30) as response:
-                data = json.loads(response.read().decode())
+            data = self._github_get_json("https://api.github.com/repos/docker/compose/releases/latest")
             tag = data['tag_name']
-            import re
-            m = re.search(r'(\d+\.\d+\.\d+)', tag)
+            m = _SEMVER_RE.search(tag)
             version = m.group(1) if m else tag.lstrip('v')
+            # latest 响应已包含资源列表，后续查找下载地址无需再请求 tags 接口
+            self._compose_assets[version] = data.get('assets', [])
             self.log(f"找到最新 Docker Compose 版本: {Colors.VALUE}{version}{Colors.RESET}", "NOTICE", "✓")
             self.set_output('compose_version', version)
             return version
@@ -208,51 +503,46 @@ class DockerUpdater:
             self.log(f"获取 Docker Compose 版本失败: {e}", "ERROR", "✗")
             return "2.32.4"
     
-    def get_compose_asset_url(self, version, arch):
+    def get_compose_asset_url(self, version, arch, assets=None):
         try:
-            tag = f"v{version}"
-            api = f"https://api.github.com/repos/docker/compose/releases/tags/{tag}"
-            req = urllib.request.Request(api)
-            req.add_header('User-Agent', 'Mozilla/5.0')
-            req.add_header('Accept', 'application/vnd.github.v3+json')
-            with urllib.request.urlopen(req, timeout=30) as resp:
-                data = json.loads(resp.read().decode())
-            assets = data.get('assets', [])
-            names = [f"docker-compose-linux-{arch}", f"docker-compose-linux-{arch}.exe"]
-            alt = {"x86_64": ["amd64"], "aarch64": ["arm64"]}.get(arch, [])
-            for a in alt:
-                names.append(f"docker-compose-linux-{a}")
-                names.append(f"docker-compose-linux-{a}.exe")
+            if assets is None:
+                assets = self._compose_assets.get(version)
+            if assets is None:
+                tag = f"v{version}"
+                data = self._github_get_json(f"https://api.github.com/repos/docker/compose/releases/tags/{tag}")
+                assets = data.get('assets', [])
+                self._compose_assets[version] = assets
+            alt = {"x86_64": ("amd64",), "aarch64": ("arm64",)}.get(arch, ())
+            arch_substrings = (arch, *alt)
+            names = frozenset(f"docker-compose-linux-{a}{ext}" for a in arch_substrings for ext in ("", ".exe"))
             for asset in assets:
                 name = asset.get('name', '')
-                url = asset.get('browser_download_url')
-                if any(name == n for n in names):
-                    return url
-                if name.startswith("docker-compose-linux-"):
-                    if arch in name or any(a in name for a in alt):
-                        return url
+                if name in names or (name.startswith("docker-compose-linux-") and any(a in name for a in arch_substrings)):
+                    return asset.get('browser_download_url')
             return None
         except Exception as e:
             self.log(f"获取 Compose 资源失败: {e}", "ERROR", "✗")
             return None
     
-    def calculate_file_hash(self, filepath, algorithm='sha256'):
-        """计算文件哈希值"""
-        hash_obj = hashlib.new(algorithm)
-        with open(filepath, 'rb') as f:
-            for chunk in iter(lambda: f.read(8192), b''):
-                hash_obj.update(chunk)
-        return hash_obj.hexdigest()
-    
     def download_file(self, url, filename, description, max_retries=3):
-        """下载文件并显示进度，支持重试"""
+        """下载文件并显示进度，传输中断时整体重试（建立连接阶段的错误与 5xx 由连接池重试）"""
         filepath = self.output_dir / filename
+        tmp_path = filepath.with_name(filename + ".part")
         
-        # 检查文件是否已存在
+        with self._lock:
+            cached = self._download_cache.get(url)
+        headers = {'User-Agent': 'Mozilla/5.0'}
+        
+        # 检查文件是否已存在：有下载记录时用条件请求确认远端未变更，否则直接跳过
         if filepath.exists():
-            self.log(f"文件已存在，跳过下载: {Colors.KEY}{filename}{Colors.RESET}", "WARNING", "⊘")
-            self.download_stats['skipped'] += 1
-            return True
+            if not (cached and cached.get('local_name') == filename and cached.get('size') == filepath.stat().st_size):
+                self.log(f"文件已存在，跳过下载: {Colors.KEY}{filename}{Colors.RESET}", "WARNING", "⊘")
+                self._add_stat('skipped')
+                return True
+            if cached.get('etag'):
+                headers['If-None-Match'] = cached['etag']
+            if cached.get('last_modified'):
+                headers['If-Modified-Since'] = cached['last_modified']
         
         for attempt in range(max_retries):
             try:
@@ -260,119 +550,143 @@ class DockerUpdater:
                     self.log(f"重试下载 ({attempt + 1}/{max_retries}): {description}", "INFO", "🔄")
                 else:
                     self.log(f"开始下载 {description}...", "INFO", "📥")
-                
                 self.log(f"  → URL: {Colors.DIMMED}{url}{Colors.RESET}", "DEBUG", "")
                 
-                req = urllib.request.Request(url)
-                req.add_header('User-Agent', 'Mozilla/5.0')
-                
-                with urllib.request.urlopen(req, timeout=120) as response:
+                with self.http.request('GET', url, headers=headers) as response:
+                    if response.status == 304:
+                        self.log(f"远端未变更，跳过下载: {Colors.KEY}{filename}{Colors.RESET}", "WARNING", "⊘")
+                        self._hashes[filename] = cached['sha256']
+                        self._add_stat('skipped')
+                        return True
+                    response.raise_for_status()
                     total_size = int(response.headers.get('content-length', 0))
-                    block_size = 8192
-                    downloaded = 0
-                    
-                    with open(filepath, 'wb') as f:
-                        while True:
-                            buffer = response.read(block_size)
-                            if not buffer:
-                                break
-                            
-                            downloaded += len(buffer)
-                            f.write(buffer)
-                            
-                            # 在 CI 模式下每 10MB 输出一次进度
-                            if self.ci_mode and total_size > 0:
-                                if downloaded % (10 * 1024 * 1024) < block_size:
-                                    percent = (downloaded / total_size) * 100
-                                    self.log(f"下载进度: {Colors.VALUE}{percent:.1f}%{Colors.RESET} ({downloaded}/{total_size} bytes)", "DEBUG", "📊")
-                            elif total_size > 0 and downloaded % (5 * 1024 * 1024) < block_size:
-                                percent = (downloaded / total_size) * 100
-                                print(f"\r{Colors.DIMMED}  → 下载进度: {Colors.VALUE}{percent:.1f}%{Colors.RESET} ({Colors.VALUE}{downloaded}/{total_size}{Colors.RESET} bytes){Colors.RESET}", end='', flush=True)
-                    
-                    if not self.ci_mode and total_size > 0:
-                        print()  # 换行
-                    
-                    # 计算文件哈希
-                    file_hash = self.calculate_file_hash(filepath)
-                    file_size = filepath.stat().st_size
-                    file_size_mb = file_size / (1024 * 1024)
-                    
-                    self.log(f"{description} 下载完成", "SUCCESS", "✓")
-                    self.log(f"  → 文件路径: {Colors.VALUE}{filepath}{Colors.RESET}", "DEBUG", "")
-                    self.log(f"  → 文件大小: {Colors.VALUE}{file_size_mb:.2f} MB{Colors.RESET}", "DEBUG", "")
-                    self.log(f"  → SHA256: {Colors.DIMMED}{file_hash}{Colors.RESET}", "DEBUG", "")
-                    
-                    self.download_stats['success'] += 1
-                    self.download_stats['total_size'] += file_size
-                    
-                    return True
-                    
-            except urllib.error.HTTPError as e:
+                    hash_obj = hashlib.sha256()
+                    # CI 模式每 10 秒、本地每 5 秒最多输出一次进度
+                    interval = 10 if self.ci_mode else 5
+                    last_report = time.monotonic()
+                
+                    def report_progress(downloaded):
+                        nonlocal last_report
+                        now = time.monotonic()
+                        if total_size <= 0 or now - last_report < interval:
+                            return
+                        last_report = now
+                        percent = (downloaded / total_size) * 100
+                        if self.ci_mode:
+                            self.log(f"{description} 下载进度: {Colors.VALUE}{percent:.1f}%{Colors.RESET} ({downloaded}/{total_size} bytes)", "DEBUG", "📊")
+                        else:
+                            self.log(f"  → {description} 下载进度: {Colors.VALUE}{percent:.1f}%{Colors.RESET} ({Colors.VALUE}{downloaded}/{total_size}{Colors.RESET} bytes)", "DEBUG", "")
+                
+                    # 先写入临时文件，完成后再替换，避免覆盖已有文件时留下残缺内容
+                    reader = _HashingReader(response, hash_obj, report_progress)
+                    with open(tmp_path, 'wb') as f:
+                        shutil.copyfileobj(reader, f, length=1 << 20)
+                    # 连接提前关闭时 read() 只返回短读而不报错，需核对长度
+                    if total_size > 0 and reader.bytes_read != total_size:
+                        raise OSError(f"下载不完整: {reader.bytes_read}/{total_size} bytes")
+                    os.replace(tmp_path, filepath)
+                    etag = response.headers.get('ETag')
+                    last_modified = response.headers.get('Last-Modified')
+                break
+            
+            except HTTPStatusError as e:
+                # 5xx 已由连接池重试，其余状态码（如 404）重试无意义
                 self.log(f"HTTP 错误 {e.code}: {description}", "ERROR", "✗")
-                if e.code == 404:
-                    self.download_stats['failed'] += 1
-                    return False
+                self._add_stat('failed')
+                return False
+            except ssl.SSLCertVerificationError as e:
+                self.log(f"证书校验失败: {e}", "ERROR", "✗")
+                tmp_path.unlink(missing_ok=True)
+                self._add_stat('failed')
+                return False
             except Exception as e:
                 self.log(f"下载失败: {e}", "ERROR", "✗")
-                if filepath.exists():
-                    filepath.unlink()
+                tmp_path.unlink(missing_ok=True)
             
             if attempt < max_retries - 1:
-                import time
                 wait_time = 2 ** attempt
-                self.log(f"等待 {Colors.VALUE}{wait_time}${Colors.RESET} 秒后重试...", "INFO", "⏳")
+                self.log(f"等待 {Colors.VALUE}{wait_time}{Colors.RESET} 秒后重试...", "INFO", "⏳")
                 time.sleep(wait_time)
+        else:
+            self._add_stat('failed')
+            return False
         
-        self.download_stats['failed'] += 1
-        return False
+        # 哈希已在下载时同步计算
+        file_hash = hash_obj.hexdigest()
+        self._hashes[filename] = file_hash
+        file_size = filepath.stat().st_size
+        
+        if etag or last_modified:
+            with self._lock:
+                self._download_cache[url] = {
+                    "etag": etag,
+                    "last_modified": last_modified,
+                    "sha256": file_hash,
+                    "size": file_size,
+                    "local_name": filename
+                }
+                error = self._save_json_cache(self.download_cache_file, self._download_cache)
+            if error:
+                self.log(f"写入缓存失败 {self.download_cache_file}: {error}", "WARNING", "⚠️")
+        
+        file_size_mb = file_size / (1024 * 1024)
+        
+        self.log(f"{description} 下载完成", "SUCCESS", "✓")
+        self.log(f"  → 文件路径: {Colors.VALUE}{filepath}{Colors.RESET}", "DEBUG", "")
+        self.log(f"  → 文件大小: {Colors.VALUE}{file_size_mb:.2f} MB{Colors.RESET}", "DEBUG", "")
+        self.log(f"  → SHA256: {Colors.DIMMED}{file_hash}{Colors.RESET}", "DEBUG", "")
+        
+        self._add_stat('success')
+        self._add_stat('total_size', file_size)
+        
+        return True
     
-    def cleanup_old_versions(self, current_docker_version, current_compose_version, arch):
-        """清理指定架构的旧版本文件"""
+    def cleanup_old_versions(self, current_versions):
+        """清理旧版本文件，current_versions 为 {arch: (docker_version, compose_version)}，只遍历一次目录"""
         try:
-            import re
+            stale = []
+            with os.scandir(self.output_dir) as entries:
+                for entry in entries:
+                    name = entry.name
+                    # docker 与 docker-rootless-extras 均以 Docker 版本为准，compose 以 Compose 版本为准
+                    match = _DOCKER_FILE_RE.fullmatch(name) or _ROOTLESS_FILE_RE.fullmatch(name)
+                    index = 0
+                    if not match:
+                        match = _COMPOSE_FILE_RE.fullmatch(name)
+                        index = 1
+                    if not match or match.group(2) not in current_versions:
+                        continue
+                    if match.group(1) != current_versions[match.group(2)][index]:
+                        stale.append(Path(entry.path))
             
-            # 清理docker旧版本
-            docker_pattern = f"docker-*-{arch}.tgz"
-            docker_files = list(self.output_dir.glob(docker_pattern))
-            for file in docker_files:
-                match = re.match(r'docker-(\d+\.\d+\.\d+)-.+\.tgz', file.name)
-                if match:
-                    file_version = match.group(1)
-                    if file_version != current_docker_version:
-                        file.unlink()
-                        self.log(f"已删除旧版本: {Colors.VALUE}{file.name}${Colors.RESET}", "DEBUG", "🗑️ ")
+            for file in stale:
+                file.unlink(missing_ok=True)
+                self.log(f"已删除旧版本: {Colors.VALUE}{file.name}{Colors.RESET}", "DEBUG", "🗑️ ")
             
-            # 清理docker-rootless-extras旧版本
-            rootless_pattern = f"docker-rootless-extras-*-{arch}.tgz"
-            rootless_files = list(self.output_dir.glob(rootless_pattern))
-            for file in rootless_files:
-                match = re.match(r'docker-rootless-extras-(\d+\.\d+\.\d+)-.+\.tgz', file.name)
-                if match:
-                    file_version = match.group(1)
-                    if file_version != current_docker_version:
-                        file.unlink()
-                        self.log(f"已删除旧版本: {Colors.VALUE}{file.name}${Colors.RESET}", "DEBUG", "🗑️ ")
-            
-            # 清理docker-compose旧版本
-            compose_pattern = f"docker-compose-linux-*-{arch}"
-            compose_files = list(self.output_dir.glob(compose_pattern))
-            for file in compose_files:
-                match = re.match(r'docker-compose-linux-(\d+\.\d+\.\d+)-.+', file.name)
-                if match:
-                    file_version = match.group(1)
-                    if file_version != current_compose_version:
-                        file.unlink()
-                        self.log(f"已删除旧版本: {Colors.VALUE}{file.name}${Colors.RESET}", "DEBUG", "🗑️ ")
-                    
+            # 同步移除已删除文件的下载缓存记录
+            removed = {file.name for file in stale}
+            error = None
+            with self._lock:
+                urls = [url for url, record in self._download_cache.items() if record.get('local_name') in removed]
+                for url in urls:
+                    del self._download_cache[url]
+                if urls:
+                    error = self._save_json_cache(self.download_cache_file, self._download_cache)
+            if error:
+                self.log(f"写入缓存失败 {self.download_cache_file}: {error}", "WARNING", "⚠️")
+        
         except Exception as e:
             self.log(f"清理旧文件时出错: {e}", "ERROR", "✗")
     
     def cleanup_logs(self, keep_count=3):
         try:
-            logs = sorted(self.output_dir.glob("update_log_*.txt"), key=lambda x: x.stat().st_mtime, reverse=True)
-            for old_log in logs[keep_count:]:
-                old_log.unlink()
-                self.log(f"已删除旧日志: {Colors.VALUE}{old_log.name}${Colors.RESET}", "DEBUG", "🗑️ ")
+            with os.scandir(self.output_dir) as it:
+                logs = [(entry.name, entry.stat().st_mtime) for entry in it
+                        if entry.name.startswith("update_log_") and entry.name.endswith(".txt")]
+            logs.sort(key=lambda item: item[1], reverse=True)
+            for name, _ in logs[keep_count:]:
+                (self.output_dir / name).unlink(missing_ok=True)
+                self.log(f"已删除旧日志: {Colors.VALUE}{name}{Colors.RESET}", "DEBUG", "🗑️ ")
         except Exception as e:
             self.log(f"清理日志时出错: {e}", "ERROR", "✗")
     
@@ -392,83 +706,141 @@ class DockerUpdater:
         
         self.log(f"版本信息已保存: {Colors.VALUE}{version_file}{Colors.RESET}", "SUCCESS", "✓")
     
+    def expected_files(self, docker_version, compose_version):
+        """当前版本下各架构应存在的文件名"""
+        files = []
+        for arch in self.architectures:
+            files.append(f"docker-{docker_version}-{arch}.tgz")
+            files.append(f"docker-compose-linux-{compose_version}-{arch}")
+            files.append(f"docker-rootless-extras-{docker_version}-{arch}.tgz")
+        return files
+    
+    def is_up_to_date(self, docker_version, compose_version):
+        """VERSION.json 与最新版本一致且所有文件及 SHA256SUMS 均已存在时返回 True"""
+        version_file = self.output_dir / "VERSION.json"
+        try:
+            with open(version_file, encoding="utf-8") as f:
+                info = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if info.get('docker_version') != docker_version or info.get('compose_version') != compose_version:
+            return False
+        if not set(self.architectures) <= set(info.get('architectures', [])):
+            return False
+        if not (self.output_dir / "SHA256SUMS").is_file():
+            return False
+        return all((self.output_dir / name).is_file() for name in self.expected_files(docker_version, compose_version))
+    
     def create_checksums_file(self):
         """创建校验和文件"""
         checksums_file = self.output_dir / "SHA256SUMS"
         
+        files = [file for file in sorted(self.output_dir.glob("*"))
+                 if file.is_file() and file.suffix in ['.tgz', ''] and file.name != 'SHA256SUMS']
+        
+        # 下载时已计算的哈希直接复用，其余文件多进程并行计算
+        hashes = {file.name: self._hashes[file.name] for file in files if file.name in self._hashes}
+        pending = [file for file in files if file.name not in hashes]
+        if len(pending) > 1:
+            with ProcessPoolExecutor(max_workers=min(len(pending), os.cpu_count() or 1)) as pool:
+                hashes.update(zip([file.name for file in pending], pool.map(_sha256_file, [str(file) for file in pending])))
+        else:
+            hashes.update((file.name, _sha256_file(file)) for file in pending)
+        
         with open(checksums_file, 'w') as f:
-            for file in sorted(self.output_dir.glob("*")):
-                if file.is_file() and file.suffix in ['.tgz', ''] and file.name != 'SHA256SUMS':
-                    sha256 = self.calculate_file_hash(file)
-                    f.write(f"{sha256}  {file.name}\n")
+            for file in files:
+                f.write(f"{hashes[file.name]}  {file.name}\n")
         
         self.log(f"校验和文件已创建: {Colors.VALUE}{checksums_file}{Colors.RESET}", "SUCCESS", "✓")
         
-    def download_for_architecture(self, arch, docker_version, compose_version):
-        """为特定架构下载所有组件"""
+    def _download_compose(self, arch, compose_version):
+        """下载指定架构的 Docker Compose"""
         arch_info = self.arch_mapping[arch]
-        self.log("", "NOTICE", "")  # 空行
-        self.log("=" * 60, "NOTICE", "")
-        self.log(f"开始下载 {Colors.VALUE}{arch_info['display_name']}{Colors.RESET} 架构文件", "NOTICE", "📦")
-        self.log("=" * 60, "NOTICE", "")
-        self.log("", "NOTICE", "")  # 空行
-        
-        results = []
-        
-        # 下载 Docker 二进制包
-        docker_filename = f"docker-{docker_version}-{arch}.tgz"
-        docker_url = self.docker_url_template.format(
-            arch=arch_info['docker_arch'],
-            version=docker_version
-        )
-        results.append(self.download_file(docker_url, docker_filename, f"Docker 二进制包 ({arch})"))
-        
-        # 下载 Docker Compose
         compose_asset_url = self.get_compose_asset_url(compose_version, arch_info['compose_arch'])
-        if compose_asset_url:
-            compose_filename = f"docker-compose-linux-{compose_version}-{arch}"
-            if self.download_file(compose_asset_url, compose_filename, f"Docker Compose ({arch})"):
-                os.chmod(self.output_dir / compose_filename, 0o755)
-                results.append(True)
-            else:
-                results.append(False)
-        else:
-            results.append(False)
-        
-        # 下载 Docker Rootless Extras
+        if not compose_asset_url:
+            return False
+        compose_filename = f"docker-compose-linux-{compose_version}-{arch}"
+        if self.download_file(compose_asset_url, compose_filename, f"Docker Compose ({arch})"):
+            os.chmod(self.output_dir / compose_filename, 0o755)
+            return True
+        return False
+    
+    def _download_rootless(self, arch, docker_version):
+        """下载指定架构的 Docker Rootless Extras，目标版本不存在时回退"""
+        arch_info = self.arch_mapping[arch]
         rootless_filename = f"docker-rootless-extras-{docker_version}-{arch}.tgz"
         rootless_url = self.rootless_url_template.format(
             arch=arch_info['docker_arch'],
             version=docker_version
         )
         if self.download_file(rootless_url, rootless_filename, f"Docker Rootless Extras ({arch})"):
-            results.append(True)
-        else:
-            avail_rootless = self.list_rootless_versions(arch_info['docker_arch'])
-            if avail_rootless:
-                fallback = avail_rootless[0]
-                self.log(f"Rootless Extras 版本 {Colors.KEY}{docker_version}{Colors.RESET} 不存在，{Colors.VALUE}{arch_info['display_name']}{Colors.RESET} 回退到 {Colors.VALUE}{fallback}{Colors.RESET}", "WARNING", "⊘")
-                rootless_filename_fb = f"docker-rootless-extras-{fallback}-{arch}.tgz"
-                rootless_url_fb = self.rootless_url_template.format(
-                    arch=arch_info['docker_arch'],
-                    version=fallback
-                )
-                results.append(self.download_file(rootless_url_fb, rootless_filename_fb, f"Docker Rootless Extras (fallback {arch})"))
-            else:
-                results.append(False)
-        
-        success_count = sum(results)
-        total_count = len(results)
-        
-        status_icon = "✓" if success_count == total_count else "⚠️"
-        status_level = "NOTICE" if success_count == total_count else "WARNING"
-        self.log(f"{Colors.VALUE}{arch_info['display_name']}{Colors.RESET} 架构下载完成: {Colors.VALUE}{success_count}/{total_count}{Colors.RESET}", status_level, status_icon)
+            return True
+        avail_rootless = self.list_rootless_versions(arch_info['docker_arch'])
+        if not avail_rootless:
+            return False
+        fallback = avail_rootless[0]
+        self.log(f"Rootless Extras 版本 {Colors.KEY}{docker_version}{Colors.RESET} 不存在，{Colors.VALUE}{arch_info['display_name']}{Colors.RESET} 回退到 {Colors.VALUE}{fallback}{Colors.RESET}", "WARNING", "⊘")
+        rootless_filename_fb = f"docker-rootless-extras-{fallback}-{arch}.tgz"
+        rootless_url_fb = self.rootless_url_template.format(
+            arch=arch_info['docker_arch'],
+            version=fallback
+        )
+        return self.download_file(rootless_url_fb, rootless_filename_fb, f"Docker Rootless Extras (fallback {arch})")
+    
+    def download_jobs_for_architecture(self, arch, docker_version, compose_version):
+        """列出特定架构需要下载的所有组件，各组件之间互不依赖"""
+        arch_info = self.arch_mapping[arch]
+        docker_filename = f"docker-{docker_version}-{arch}.tgz"
+        docker_url = self.docker_url_template.format(
+            arch=arch_info['docker_arch'],
+            version=docker_version
+        )
+        return [
+            lambda: self.download_file(docker_url, docker_filename, f"Docker 二进制包 ({arch})"),
+            lambda: self._download_compose(arch, compose_version),
+            lambda: self._download_rootless(arch, docker_version),
+        ]
+    
+    def download_all(self, versions, compose_version):
+        """并发下载所有架构的全部组件，返回 {arch: (成功数, 总数)}"""
+        jobs = []
+        for arch in self.architectures:
+            for job in self.download_jobs_for_architecture(arch, versions[arch], compose_version):
+                jobs.append((arch, job))
+        
+        self.log(f"共 {Colors.VALUE}{len(jobs)}{Colors.RESET} 个下载任务，并发数 {Colors.VALUE}{self.max_workers}{Colors.RESET}", "NOTICE", "📦")
+        
+        results = {arch: [] for arch in self.architectures}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = [(arch, pool.submit(job)) for arch, job in jobs]
+            for arch, future in futures:
+                try:
+                    results[arch].append(bool(future.result()))
+                except Exception as e:
+                    self.log(f"下载任务异常: {e}", "ERROR", "✗")
+                    results[arch].append(False)
+        
+        summary = {}
+        for arch in self.architectures:
+            arch_info = self.arch_mapping[arch]
+            success_count = sum(results[arch])
+            total_count = len(results[arch])
+            status_icon = "✓" if success_count == total_count else "⚠️"
+            status_level = "NOTICE" if success_count == total_count else "WARNING"
+            self.log(f"{Colors.VALUE}{arch_info['display_name']}{Colors.RESET} 架构下载完成: {Colors.VALUE}{success_count}/{total_count}{Colors.RESET}", status_level, status_icon)
+            summary[arch] = (success_count, total_count)
         self.log("", "NOTICE", "")  # 空行
         
-        return success_count, total_count
+        return summary
     
     def update(self):
-        """执行更新流程"""
+        """执行更新流程，无论成功与否都写出已设置的 GitHub Actions 输出"""
+        try:
+            return self._run_update()
+        finally:
+            self.flush_outputs()
+    
+    def _run_update(self):
         self.log("", "NOTICE", "")
         self.log("=" * 60, "NOTICE", "")
         self.log("开始 Docker 离线安装包更新流程", "NOTICE", "🚀")
@@ -481,27 +853,36 @@ class DockerUpdater:
         
         self.log("", "NOTICE", "")
         
+        # 本地已是最新版本且文件齐全时直接结束，不再探测或下载
+        if self.is_up_to_date(docker_version, compose_version):
+            files = self.expected_files(docker_version, compose_version)
+            self.log(f"本地已是最新版本 (Docker {Colors.VALUE}{docker_version}{Colors.RESET}, Compose {Colors.VALUE}{compose_version}{Colors.RESET})，无需更新", "NOTICE", "✓")
+            self.cleanup_logs(keep_count=3)
+            self.set_output('success_count', str(len(files)))
+            self.set_output('total_count', str(len(files)))
+            # total_size_mb 统计的是本次运行下载的字节数，与正常流程保持一致
+            self.set_output('total_size_mb', "0.00")
+            return True
+        
         total_success = 0
         total_count = 0
         
-        # 为每个架构解析可用版本并下载文件
+        # 为每个架构解析可用版本（清理阶段复用），然后并发下载所有文件
+        versions = {}
         for arch in self.architectures:
-            resolved_version = self.resolve_static_version_for_arch(self.arch_mapping[arch]['docker_arch'], docker_version)
-            success, count = self.download_for_architecture(arch, resolved_version, compose_version)
+            versions[arch] = self.resolve_static_version_for_arch(self.arch_mapping[arch]['docker_arch'], docker_version)
+        
+        for success, count in self.download_all(versions, compose_version).values():
             total_success += success
             total_count += count
         
-        # 创建校验和文件
+        # 先清理旧版本文件，再创建校验和文件，避免列入已删除的旧版本
+        self.cleanup_old_versions({arch: (versions[arch], compose_version) for arch in self.architectures})
         self.create_checksums_file()
         
         # 创建版本信息
         self.create_version_info(docker_version, compose_version)
         
-        # 清理旧版本文件与日志
-        for arch in self.architectures:
-            resolved_docker_version = self.resolve_static_version_for_arch(self.arch_mapping[arch]['docker_arch'], docker_version)
-            self.cleanup_old_versions(resolved_docker_version, compose_version, arch)
-            
         self.cleanup_logs(keep_count=3)
         
         # 总结
@@ -529,8 +910,8 @@ class DockerUpdater:
 
 def main():
     # 检查 Python 版本
-    if sys.version_info < (3, 6):
-        print("错误: 需要 Python 3.6 或更高版本")
+    if sys.version_info < (3, 8):
+        print("错误: 需要 Python 3.8 或更高版本")
         sys.exit(1)
     
     # 命令行参数解析
@@ -554,6 +935,10 @@ def main():
                         choices=['x86_64', 'aarch64', 'all'],
                         default=['all'],
                         help='指定架构 (默认: all)')
+    parser.add_argument('-j', '--jobs',
+                        type=int,
+                        default=8,
+                        help='并发下载数 (默认: 8)')
     parser.add_argument('--ci', 
                         action='store_true',
                         help='CI 模式（优化日志输出）')
@@ -573,7 +958,8 @@ def main():
     updater = DockerUpdater(
         output_dir=args.output, 
         architectures=architectures,
-        ci_mode=ci_mode
+        ci_mode=ci_mode,
+        max_workers=max(1, args.jobs)
     )
     
     # 执行更新